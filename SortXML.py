@@ -1,10 +1,18 @@
 import xml.etree.ElementTree as ET
-from collections import OrderedDict
-import xml.dom.minidom
+from collections import OrderedDict, defaultdict
 import re
+import io
 import argparse
 import os.path
 from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+from xml.sax.saxutils import escape
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml is optional, the standard library is used as a fallback
+    lxml_etree = None
 
 __version__ = "3.0"
 
@@ -32,47 +40,153 @@ element_priority_keywords_map = {
     # Example: "SubElementName": ["priority1", "priority2", ...]
 }
 
-def xml_to_dict(element):
+def build_priority_index(keywords):
     """
-    Recursively converts an XML element and its children into a Python dictionary.
+    Builds a lookup table from lowercase keyword to its position in a priority list.
+
+    If two keywords only differ in case, the first one keeps its position.
+
+    Args:
+        keywords (list): A list of priority keywords.
 
-    If an element has no children, its text content is taken as the value.
-    If multiple children have the same tag, their values are aggregated into a list.
-    XML namespaces are removed from the tags.
+    Returns:
+        dict: A dictionary mapping each lowercase keyword to its index in the list.
+    """
+    index = {}
+    for i, keyword in enumerate(keywords):
+        index.setdefault(keyword.lower(), i)
+    return index
+
+# Lookup tables used by sort_dict, built once from the priority keyword lists above
+_priority_index = build_priority_index(priority_keywords)
+_element_priority_index = {tag: build_priority_index(keywords)
+                           for tag, keywords in element_priority_keywords_map.items()}
+
+# Regular expressions used to find CDATA sections and escaped XML content,
+# compiled once instead of on every call
+_NAMESPACE_RE = re.compile(r'\{(.+?)\}')
+_ELEMENT_BLOCK_RE = re.compile(r'<([^\s>]+)[^>]*>([\s\S]*?)</\1>')
+_CDATA_INNER_RE = re.compile(r'<([^>]+)>\s*<!\[CDATA\[(.*?)\]\]>', re.DOTALL)
+_IDENTIFIER_RE = re.compile(r'<(profileName|name|id|keyname|cfgname|cfgName)>([^<]+)</\1>')
+_XML_DECL_RE = re.compile(r'<([^>]+)>([^<>]*?&lt;\?xml version=\"|&lt;\?xml version=\'|&lt;\?xml version=).*?</[^>]*>', re.DOTALL)
+
+@lru_cache(maxsize=4096)
+def _strip_ns(tag):
+    """
+    Removes the namespace from an element tag.
 
     Args:
-        element (xml.etree.ElementTree.Element): The XML element to convert.
+        tag (str): The element tag, e.g. "{http://example.com}root".
 
     Returns:
-        dict or str: A dictionary representing the XML element's structure,
-                     or a string if the element has text content but no children.
-                     Returns an empty string if the element has no children and no text.
+        str: The tag without its namespace, e.g. "root".
+    """
+    i = tag.find('}')
+    return tag[i + 1:] if i >= 0 else tag
+
+class CDATAStr(str):
+    """
+    A string that was read from a CDATA section and is written back as one.
+
+    It behaves like a normal string, the type only tells write_xml to emit
+    the value as <![CDATA[...]]> instead of escaping it.
+    """
+    __slots__ = ()
+
+def xml_file_to_dict(source, cdata_texts=None):
     """
-    children = list(element)
-    if not children:
-        return element.text.strip() if element.text else ''
-    result = {}
-    for child in children:
-        tag = child.tag.split('}')[-1]  # Remove namespace
-        value = xml_to_dict(child)
-        if tag in result:
-            if isinstance(result[tag], list):
-                result[tag].append(value)
+    Parses an XML file and converts it into a Python dictionary in a single pass.
+
+    The file is read with iterparse and each element is converted as soon as its
+    end tag is seen. If an element has no children, its text content is taken as
+    the value. If multiple children have the same tag, their values are aggregated
+    into a list. XML namespaces are removed from the tags. Converted elements are
+    cleared and detached from their parent right away, so the full element tree is
+    never kept in memory next to the dictionary.
+
+    Text that was read from a CDATA section is returned as a CDATAStr holding the
+    original section content, so that it is written back as CDATA. Candidates are
+    looked up in cdata_texts by tag and text. ElementTree drops CDATA boundaries,
+    so the candidates are taken as they are; lxml is told to keep CDATA sections in
+    the tree, so each candidate is checked against the element itself and elements
+    that only share the tag and text of a CDATA section stay plain text.
+
+    Args:
+        source (str or file object): Path to the XML file, or a binary file object
+                                     (e.g., io.BytesIO) holding its content.
+        cdata_texts (dict, optional): A dictionary mapping (tag, stripped_text) tuples
+                                      to the content of the CDATA section the text was
+                                      read from, as built from find_cdata_sections.
+                                      Defaults to None.
+
+    Returns:
+        tuple: A (root_tag, value) tuple where root_tag is the tag of the root element
+               including its namespace (e.g., "{http://example.com}root") and value is
+               the converted root element, a dictionary or a string if it has no children.
+    """
+    if lxml_etree is not None:
+        events = lxml_etree.iterparse(source, events=("start", "end"), huge_tree=True, strip_cdata=False,
+                                      remove_blank_text=True, remove_comments=True, remove_pis=True)
+    else:
+        events = ET.iterparse(source, events=("start", "end"))
+
+    # Each entry holds an open element and the lists of its converted children by tag
+    stack = []
+    root_tag = None
+    root_value = ''
+    for event, element in events:
+        if event == "start":
+            stack.append((element, defaultdict(list)))
+            continue
+
+        _, children = stack.pop()
+        tag = _strip_ns(element.tag)
+        if children:
+            # Tags that appear only once keep their single value instead of a list
+            value = {child_tag: values[0] if len(values) == 1 else values
+                     for child_tag, values in children.items()}
+        else:
+            # Read the text once, lxml builds a new string on every access. Empty
+            # elements, the most common leaves, skip the strip and the CDATA lookup
+            text = element.text
+            if not text:
+                value = ''
             else:
-                result[tag] = [result[tag], value]
+                value = text.strip()
+                if value and cdata_texts:
+                    cdata_text = cdata_texts.get((tag, value))
+                    if cdata_text is not None:
+                        if lxml_etree is None:
+                            value = CDATAStr(cdata_text)
+                        elif b'<![CDATA[' in lxml_etree.tostring(element, with_tail=False):
+                            value = CDATAStr(text)
+
+        if stack:
+            parent, siblings = stack[-1]
+            siblings[tag].append(value)
+            # Drop the previously converted siblings, the current element is
+            # kept until the parser is done with it
+            del parent[:-1]
         else:
-            result[tag] = value
-    return result
+            root_tag = element.tag
+            root_value = value
+        element.clear()
+
+    return root_tag, root_value
 
 def sort_dict(d, parent_tag=None):
     """
-    Recursively sorts a dictionary or a list of dictionaries.
+    Sorts a dictionary or a list of dictionaries, including all nested ones.
 
-    For dictionaries, items are sorted based on a priority key function.
+    For dictionaries, items are sorted based on a priority key.
     Keys listed in the global priority_keywords list or in element_priority_keywords_map
     for specific sub-elements are placed first, in the order they appear in the list.
     Remaining keys are sorted alphabetically (case-insensitive).
-    If the input is a list, each item in the list is sorted recursively.
+    If the input is a list, each item in the list is sorted.
+
+    The nesting is walked with an explicit stack rather than recursive calls. Each
+    sorted dictionary or list is created with its final key order right away, and
+    the values that still need sorting are filled in when they are taken off the stack.
 
     Args:
         d (dict or list): The dictionary or list to be sorted.
@@ -83,139 +197,209 @@ def sort_dict(d, parent_tag=None):
         OrderedDict or list or any:
             - An OrderedDict if the input d is a dictionary, with keys sorted
               according to the priority logic.
-            - A list if the input d is a list, with each element recursively sorted.
+            - A list if the input d is a list, with each element sorted.
             - The original item d if it's neither a dictionary nor a list.
     """
-    if isinstance(d, dict):
-        # First, sort all items case-insensitively by key
+    if not isinstance(d, (dict, list)):
+        return d
+
+    result = [None]
+    # Each entry holds (container, slot, value, parent_tag): the sorted value is stored in container[slot]
+    stack = [(result, 0, d, parent_tag)]
+    while stack:
+        container, slot, value, tag = stack.pop()
+
+        if isinstance(value, list):
+            sorted_list = list(value)
+            for i, item in enumerate(value):
+                if isinstance(item, (dict, list)):
+                    # List items use the same parent tag as the list
+                    stack.append((sorted_list, i, item, tag))
+            container[slot] = sorted_list
+            continue
+
+        # Use the specific priority keywords for this parent tag if there are any,
+        # otherwise the general priority_keywords
+        priority_index = _element_priority_index.get(tag, _priority_index)
+
+        # Build the sort key of each item while collecting them, so sorting does not
+        # call back into Python for every key: (0, index) for priority keys, which come
+        # first in the order of their list, (1, key_lower_case) for the other keys,
+        # which come after sorted alphabetically
         items = []
-        for k, v in d.items():
-            # Pass the current key as parent_tag for nested dictionaries
-            sorted_v = sort_dict(v, k)
-            items.append((k, sorted_v))
-        items = sorted(items, key=lambda x: x[0].lower())
-
-        # Then, create a custom sorting key function that prioritizes certain keywords
-        def priority_key_func(item):
-            """
-            Generates a sort key for an item (key-value pair).
-
-            Priority is given to keys found in priority_keywords or in element_priority_keywords_map
-            for the specific parent_tag.
-
-            Args:
-                item (tuple): A (key, value) tuple from the dictionary.
-
-            Returns:
-                tuple: A tuple used for sorting. (0, index) for priority keys,
-                       (1, key_lower_case) for other keys.
-            """
-            key_lower = item[0].lower()
-            
-            # Check if we have specific priority keywords for this parent tag
-            if parent_tag and parent_tag in element_priority_keywords_map:
-                # Use the specific priority keywords for this parent tag
-                specific_priority_keywords = element_priority_keywords_map[parent_tag]
-                for i, p_key in enumerate(specific_priority_keywords):
-                    if key_lower == p_key.lower():
-                        return (0, i)  # Priority items come first, sorted by their order
-            else:
-                # Use the general priority_keywords
-                for i, p_key in enumerate(priority_keywords):
-                    if key_lower == p_key.lower():
-                        return (0, i)  # Priority items come first, sorted by their order
-            
-            return (1, key_lower)  # Non-priority items come after, sorted alphabetically
+        for k, v in value.items():
+            key_lower = k.lower()
+            index = priority_index.get(key_lower)
+            sort_key = (1, key_lower) if index is None else (0, index)
+            items.append((sort_key, k, v))
+        items.sort(key=itemgetter(0))
+
+        sorted_dict = OrderedDict()
+        for _, k, v in items:
+            sorted_dict[k] = v
+            if isinstance(v, (dict, list)):
+                # Pass the current key as parent_tag for nested dictionaries
+                stack.append((sorted_dict, k, v, k))
+        container[slot] = sorted_dict
+
+    return result[0]
+
+def _looks_like_xml(text):
+    """
+    Checks whether a text is XML content, e.g. an XML document stored in an element.
 
-        # Sort again with the priority key function
-        return OrderedDict(sorted(items, key=priority_key_func))
-    elif isinstance(d, list):
-        return [sort_dict(i, parent_tag) for i in d]
-    else:
-        return d
+    Args:
+        text (str): The unescaped text.
 
-def dict_to_xml(tag, d, namespace=None):
+    Returns:
+        bool: True if the text has a '<' followed by a '>' and a closing or empty tag.
     """
-    Recursively converts a Python dictionary back into an XML element.
+    start = text.find('<')
+    return start >= 0 and text.find('>', start) >= 0 and ('</' in text or '/>' in text)
 
-    If a value in the dictionary is a list, multiple child elements with the
-    same tag are created for each item in the list.
-    If a value is not a dictionary or list, its string representation becomes
-    the text content of the element.
-    A namespace can be added to the created root element.
+def _text_element_line(indent, start_tag, tag, value, cdata_tags):
+    """
+    Formats a line of write_xml output for an element that holds text.
 
     Args:
-        tag (str): The tag name for the current XML element being created.
-        d (dict or any): The dictionary to convert into an XML element. If not a
-                         dictionary, its string representation is used as text content.
-        namespace (dict, optional): A dictionary defining the namespace attributes
-                                    for the element (e.g., {"xmlns": "http://example.com"}).
-                                    Defaults to None.
+        indent (str): The indentation of the line.
+        start_tag (str): The tag name, with its attributes if there are any.
+        tag (str): The tag name for the closing tag.
+        value (any): The value of the element, its string representation is the text.
+        cdata_tags (set): Tags whose text is always written as a CDATA section.
 
     Returns:
-        xml.etree.ElementTree.Element: The constructed XML element.
+        str: The element on one line, ending with a newline.
     """
-    if namespace:
-        elem = ET.Element(tag, attrib=namespace)
-    else:
-        elem = ET.Element(tag)
-    if isinstance(d, dict):
-        for key, val in d.items():
-            if isinstance(val, list):
-                for item in val:
-                    child = dict_to_xml(key, item)
-                    elem.append(child)
-            else:
-                child = dict_to_xml(key, val)
-                elem.append(child)
-    else:
-        elem.text = str(d)
-    return elem
+    text = str(value)
+    if not text:
+        return f"{indent}<{start_tag}/>\n"
+    if isinstance(value, CDATAStr) or tag in cdata_tags or _looks_like_xml(text):
+        # A CDATA section cannot contain ]]>, split it over two sections
+        text = text.replace("]]>", "]]]]><![CDATA[>")
+        return f"{indent}<{start_tag}><![CDATA[{text}]]></{tag}>\n"
+    # Most texts have nothing to escape
+    if '&' in text or '<' in text or '>' in text:
+        text = escape(text)
+    return f"{indent}<{start_tag}>{text}</{tag}>\n"
+
+def _child_items(d):
+    """
+    Iterates over the child elements of a dictionary in write_xml output order.
 
-def prettify(elem):
+    Args:
+        d (dict): The dictionary of an element with children.
+
+    Yields:
+        tuple: A (tag, value) tuple for each child element, a list value gives
+               one tuple for each of its items.
+    """
+    for key, val in d.items():
+        if isinstance(val, list):
+            for item in val:
+                yield key, item
+        else:
+            yield key, val
+
+def write_xml(out, tag, d, namespace=None, level=0, cdata_tags=frozenset()):
     """
-    Converts an XML element to a pretty-printed string.
+    Writes a Python dictionary as pretty-printed XML to a text stream.
+
+    If a value in the dictionary is a list, an element with the same tag is written
+    for each item in the list. The output has four spaces of indentation per level,
+    one element per line and empty values written as <tag/>. CDATAStr values, text of
+    elements in cdata_tags and text that looks like XML content (e.g. an XML document
+    stored in an element) are written as CDATA sections, other text is escaped.
 
-    The output string is indented for readability and the XML declaration
-    (e.g., <?xml version="1.0" ?>) is removed.
+    The XML is written line by line straight to the stream, without building an
+    element tree first. The nesting is walked with an explicit stack of open elements
+    rather than recursive calls, so deeply nested documents do not hit the recursion limit.
 
     Args:
-        elem (xml.etree.ElementTree.Element): The XML element to format.
+        out (io.TextIOBase): The stream to write to, e.g. an io.StringIO or an open file.
+        tag (str): The tag name for the current XML element being written.
+        d (dict or any): The dictionary to write as an XML element. If not a
+                         dictionary, its string representation is used as text content.
+        namespace (dict, optional): A dictionary defining the namespace attributes
+                                    for the element (e.g., {"xmlns": "http://example.com"}).
+                                    Defaults to None.
+        level (int, optional): The indentation level of the element. Defaults to 0.
+        cdata_tags (set, optional): Tags whose text is always written as a CDATA section.
+                                    Defaults to an empty set.
 
     Returns:
-        str: A string containing the pretty-printed XML, without the XML declaration.
+        None
     """
-    rough_string = ET.tostring(elem, 'utf-8')
-    reparsed = xml.dom.minidom.parseString(rough_string)
-    # Get pretty XML with indentation
-    pretty_xml_with_decl = reparsed.toprettyxml(indent="    ")
-    # Remove the XML declaration line
-    pretty_xml = pretty_xml_with_decl.split('\n', 1)[1] if '<?xml' in pretty_xml_with_decl else pretty_xml_with_decl
-    # Ensure double quotes aren't converted to &quot;
-    pretty_xml = pretty_xml.replace("&quot;", '"')
-    return pretty_xml
-
-def find_cdata_sections(file_path):
+    indent = "    " * level
+    start_tag = tag
+    if namespace:
+        for name, value in namespace.items():
+            value = escape(value, {'"': '&quot;'})
+            start_tag += f' {name}="{value}"'
+
+    if not isinstance(d, dict):
+        out.write(_text_element_line(indent, start_tag, tag, d, cdata_tags))
+        return
+    if not d:
+        out.write(f"{indent}<{start_tag}/>\n")
+        return
+
+    write = out.write
+    write(f"{indent}<{start_tag}>\n")
+    # Each entry holds (tag, indent, children) for an open element, where children
+    # iterates over the child elements that are not written yet
+    stack = [(tag, indent, _child_items(d))]
+    while stack:
+        tag, indent, children = stack[-1]
+        child_indent = indent + "    "
+        for key, item in children:
+            if isinstance(item, dict):
+                if not item:
+                    write(f"{child_indent}<{key}/>\n")
+                    continue
+                # Open the nested element and continue with its children, the
+                # remaining children of this element are written once it is closed
+                write(f"{child_indent}<{key}>\n")
+                stack.append((key, child_indent, _child_items(item)))
+                break
+            elif type(item) is str and item and '<' not in item and key not in cdata_tags:
+                # Plain text, the common case, is written without the helper call.
+                # There is no '<', so only the characters that are present are escaped
+                if '&' in item:
+                    item = item.replace('&', '&amp;')
+                if '>' in item:
+                    item = item.replace('>', '&gt;')
+                write(f"{child_indent}<{key}>{item}</{key}>\n")
+            else:
+                write(_text_element_line(child_indent, key, key, item, cdata_tags))
+        else:
+            # All the children are written
+            stack.pop()
+            write(f"{indent}</{tag}>\n")
+
+def find_cdata_sections(content):
     """
-    Find all CDATA sections in an XML file.
+    Find all CDATA sections in the content of an XML file.
     
     Args:
-        file_path (str): Path to the XML file.
+        content (str): The content of the XML file.
         
     Returns:
         list: A list of tuples containing (element_context, element_tag, cdata_content)
               where element_context is the surrounding XML content that helps identify
               the specific element instance.
     """
-    with open(file_path, 'r') as f:
-        content = f.read()
-    
+    # Most files have no CDATA section at all, a substring search is much cheaper
+    # than the block scan below
+    if '<![CDATA[' not in content:
+        return []
+
     # Find all CDATA sections
     # Look for patterns like <TransRouting>...<profileName>Mav_Trr_Asbc_1</profileName>...<profileXml><![CDATA[...]]></profileXml>
     # We need to capture enough context to uniquely identify each element
     
     # First, find all element blocks that contain CDATA sections
-    element_blocks = re.finditer(r'<([^\s>]+)[^>]*>([\s\S]*?)</\1>', content)
+    element_blocks = _ELEMENT_BLOCK_RE.finditer(content)
     
     cdata_sections = []
     
@@ -224,109 +408,58 @@ def find_cdata_sections(file_path):
         element_content = block_match.group(2)
         
         # Check if this block contains a CDATA section
-        cdata_matches = re.finditer(r'<([^>]+)>\s*<!\[CDATA\[(.*?)\]\]>', element_content, re.DOTALL)
+        if '<![CDATA[' not in element_content:
+            continue
+        
+        # Extract a context signature to uniquely identify this element
+        # Look for identifying elements like profileName, id, name, etc.
+        context_signature = element_tag  # Start with the parent element tag
+        
+        # Try to find identifiers in the element content
+        identifiers = _IDENTIFIER_RE.findall(element_content)
+        if identifiers:
+            # Add identifiers to the context signature
+            for id_type, id_value in identifiers:
+                context_signature += f":{id_type}={id_value}"
+        
+        cdata_matches = _CDATA_INNER_RE.finditer(element_content)
         
         for cdata_match in cdata_matches:
             cdata_element_tag = cdata_match.group(1).strip()
             cdata_content = cdata_match.group(2)
             
-            # Extract a context signature to uniquely identify this element
-            # Look for identifying elements like profileName, id, name, etc.
-            context_signature = element_tag  # Start with the parent element tag
-            
-            # Try to find identifiers in the element content
-            identifiers = re.findall(r'<(profileName|name|id|keyname|cfgname|cfgName)>([^<]+)</\1>', element_content)
-            if identifiers:
-                # Add identifiers to the context signature
-                for id_type, id_value in identifiers:
-                    context_signature += f":{id_type}={id_value}"
-            
             # Create a unique context key for this CDATA section
             element_context = f"{context_signature}:{cdata_element_tag}"
             cdata_sections.append((element_context, cdata_element_tag, cdata_content))
     
     return cdata_sections
 
-def find_xml_declaration_escaped_content(file_path):
+def find_xml_declaration_escaped_content(content):
     """
     Find all XML elements that contain escaped XML content starting with XML declaration.
     Only detects content that starts with &lt;?xml version="1.0"
     
     Args:
-        file_path (str): Path to the XML file.
+        content (str): The content of the XML file.
         
     Returns:
         dict: A dictionary mapping element paths to their escaped XML content.
     """
-    with open(file_path, 'r') as f:
-        content = f.read()
-    
     # Dictionary to store elements with escaped XML content
     escaped_xml_elements = {}
+
+    # Every match contains an escaped declaration, skip the scan when there is none
+    if '&lt;?xml version=' not in content:
+        return escaped_xml_elements
     
-    # Pattern to find elements with escaped XML declaration
-    xml_decl_pattern = re.compile(r'<([^>]+)>([^<>]*?&lt;\?xml version=\"|&lt;\?xml version=\'|&lt;\?xml version=).*?</[^>]*>', re.DOTALL)
-    
-    for match in xml_decl_pattern.finditer(content):
+    # Find elements with escaped XML declaration
+    for match in _XML_DECL_RE.finditer(content):
         element_tag = match.group(1).strip()
         element_content = match.group(2) + match.group(0)[match.start(2) + len(match.group(2)):match.end(0) - len(f'</{element_tag.split()[0]}>')]
         escaped_xml_elements[element_tag] = element_content
     
     return escaped_xml_elements
 
-def find_xml_content_in_elements(file_path, target_elements):
-    """
-    Find XML content in specific elements, whether in CDATA or escaped format.
-    This function is used to identify and preserve XML content in any element,
-    not just specific ones like TransRouting or normalizationSettings.
-    
-    Args:
-        file_path (str): Path to the XML file.
-        target_elements (list): List of element names to look for.
-        
-    Returns:
-        dict: A dictionary mapping element contexts to their XML content.
-    """
-    with open(file_path, 'r') as f:
-        content = f.read()
-    
-    xml_content_map = {}
-    
-    # Process each target element
-    for target_element in target_elements:
-        # Find all instances of the target element
-        element_pattern = re.compile(f'<{target_element}[^>]*>(.*?)</{target_element}>', re.DOTALL)
-        
-        for element_match in element_pattern.finditer(content):
-            element_content = element_match.group(1)
-            
-            # Extract identifiers to create a unique context key
-            identifiers = re.findall(r'<(profileName|name|id)>([^<]+)</\1>', element_content)
-            context_key = target_element
-            
-            if identifiers:
-                for id_type, id_value in identifiers:
-                    context_key += f":{id_type}={id_value}"
-            
-            # Look for XML content in this element (either in CDATA or escaped)
-            # First check for CDATA sections
-            cdata_matches = re.finditer(r'<([^>]+)>\s*<!\[CDATA\[(.*?)\]\]>', element_content, re.DOTALL)
-            
-            for cdata_match in cdata_matches:
-                xml_tag = cdata_match.group(1).strip()
-                xml_content = cdata_match.group(2)
-                xml_content_map[f"{context_key}:{xml_tag}"] = ("cdata", xml_content)
-            
-            # Then check for escaped XML content
-            escaped_matches = re.finditer(r'<([^>]+)>([^<]*?&lt;[^>]*?&gt;[^<]*?)</\1>', element_content, re.DOTALL)
-            
-            for escaped_match in escaped_matches:
-                xml_tag = escaped_match.group(1).strip()
-                escaped_content = escaped_match.group(2)
-                xml_content_map[f"{context_key}:{xml_tag}"] = ("escaped", escaped_content)
-    
-    return xml_content_map
-
 def process_xml_file(input_file, output_file):
     """
     Processes an XML file by parsing, sorting, and then writing it back.
@@ -340,9 +473,10 @@ def process_xml_file(input_file, output_file):
     escaped XML entities that starts with XML declaration (&lt;?xml version="1.0") 
     is converted to CDATA sections. Any escaped XML entities (&lt;, &gt;, etc.) are
     converted back to proper CDATA format.
-    
-    Special handling is provided for elements like TransRouting and normalizationSettings
-    to ensure their XML content is properly preserved as CDATA.
+
+    The output is written to the file while the sorted dictionary is serialized, so
+    the output document is never held in memory as a whole. If writing fails, the
+    partly written output file is removed.
 
     Args:
         input_file (str): The path to the input XML file.
@@ -354,247 +488,56 @@ def process_xml_file(input_file, output_file):
     Raises:
         ValueError: If the input file appears to be a CDB-backup file (starts with "<config")
     """
-    # First, find and store all CDATA sections with their context
-    cdata_sections = find_cdata_sections(input_file)
-    
-    # Find and store all elements with escaped XML content that starts with XML declaration
-    escaped_xml_elements = find_xml_declaration_escaped_content(input_file)
-    
-    # Find all elements with XML content that might need special handling
-    # First, get a list of all elements that have CDATA sections
-    element_tags_with_cdata = set()
-    for element_context, element_tag, _ in cdata_sections:
-        parent_tag = element_context.split(':')[0]
-        element_tags_with_cdata.add(parent_tag)
-    
-    # Add known elements that often have XML content
-    special_elements = list(element_tags_with_cdata)
-    special_elements.extend(["TransRouting", "normalizationSettings"])
-    # Remove duplicates
-    special_elements = list(set(special_elements))
-    
-    # Find XML content in all these elements
-    xml_content_in_special_elements = find_xml_content_in_elements(input_file, special_elements)
-    
-    # Read the input file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        xml_content = f.read()
+    # Read the input file once, the content is shared by the parser and all the find_* helpers
+    with open(input_file, 'rb') as f:
+        xml_bytes = f.read()
+    xml_content = xml_bytes.decode('utf-8')
         
     # Check if this is a CDB-backup file (starts with <config>)
     if xml_content.lstrip().startswith('<config'):
         raise ValueError("This appears to be a CDB-backup file. This tool is not compatible with CDB-backup files. Please use a standard XML file that can be uploaded to CMS.")
     
-    # Parse the XML file
-    tree = ET.parse(input_file)
-    root = tree.getroot()
+    # First, find and store all CDATA sections with their context
+    cdata_sections = find_cdata_sections(xml_content)
+    
+    # Find and store the tags of all elements with escaped XML content that starts with XML declaration,
+    # the text of these elements is written as CDATA
+    xml_declaration_tags = set(find_xml_declaration_escaped_content(xml_content))
+    
+    # Texts read from CDATA sections, keyed by element tag and the text as the parser
+    # returns it, so they are written back as CDATA
+    cdata_texts = {}
+    for _, element_tag, cdata_content in cdata_sections:
+        cdata_texts[(element_tag.split()[0], cdata_content.strip())] = cdata_content
+
+    # Parse the XML content and convert it to a dictionary, the parser reads the bytes
+    # so that the encoding declared in the file is honoured
+    root_element_tag, root_value = xml_file_to_dict(io.BytesIO(xml_bytes), cdata_texts)
 
     # Extract namespace if present
     namespace = None
-    namespace_match = re.match(r'\{(.+?)\}', root.tag)
+    namespace_match = _NAMESPACE_RE.match(root_element_tag)
     if namespace_match:
         namespace_uri = namespace_match.group(1)
         namespace = {"xmlns": namespace_uri}
 
     # Get root tag without namespace
-    root_tag = root.tag.split('}')[-1]
+    root_tag = _strip_ns(root_element_tag)
 
-    # Convert to dictionary and sort
-    xml_dict = {root_tag: xml_to_dict(root)}
+    # Sort the dictionary
+    xml_dict = {root_tag: root_value}
     sorted_dict = sort_dict(xml_dict, root_tag)
 
-    # Convert back to XML with namespace preserved
-    new_root = dict_to_xml(root_tag, sorted_dict[root_tag], namespace)
-    pretty_xml_output = prettify(new_root)
-    
-    # Restore CDATA sections in the output
-    # Group CDATA sections by element tag for easier processing
-    cdata_by_tag = {}
-    for element_context, element_tag, cdata_content in cdata_sections:
-        if element_tag not in cdata_by_tag:
-            cdata_by_tag[element_tag] = []
-        cdata_by_tag[element_tag].append((element_context, cdata_content))
-    
-    # Process each element type that has CDATA sections
-    for element_tag, context_content_pairs in cdata_by_tag.items():
-        # If there's only one CDATA section for this tag, use the simple approach
-        if len(context_content_pairs) == 1:
-            _, cdata_content = context_content_pairs[0]
-            pattern = f'<{element_tag}>([^<]*)</[^>]*>'
-            
-            def create_cdata_replacement(match):
-                return f'<{element_tag}><![CDATA[{cdata_content}]]></{element_tag.split()[0]}>'
-            
-            pretty_xml_output = re.sub(pattern, create_cdata_replacement, pretty_xml_output)
-        else:
-            # For multiple CDATA sections with the same tag, we need to match based on context
-            for element_context, cdata_content in context_content_pairs:
-                # Extract the parent element tag and identifiers
-                context_parts = element_context.split(':')
-                parent_tag = context_parts[0]
-                
-                # Build a pattern that includes the context
-                if len(context_parts) > 1:
-                    # We have identifiers to help match the specific element
-                    identifiers = context_parts[1:-1]  # Skip the last part which is the CDATA element tag
-                    
-                    # Create a pattern to find the specific element instance
-                    # This is a complex pattern that tries to match the element with its identifiers
-                    parent_pattern = f'<{parent_tag}[^>]*>(.*?)</{parent_tag}>'
-                    
-                    # Find all instances of the parent element
-                    for parent_match in re.finditer(parent_pattern, pretty_xml_output):
-                        parent_content = parent_match.group(1)
-                        
-                        # Check if this parent element contains all the identifiers
-                        is_matching_element = True
-                        for identifier in identifiers:
-                            id_parts = identifier.split('=')
-                            if len(id_parts) == 2:
-                                id_type, id_value = id_parts
-                                # Check if this identifier exists in the parent content
-                                if not re.search(f'<{id_type}>{re.escape(id_value)}</{id_type}>', parent_content):
-                                    is_matching_element = False
-                                    break
-                        
-                        if is_matching_element:
-                            # This is the matching element, replace its CDATA section
-                            cdata_pattern = f'<{element_tag}>([^<]*)</[^>]*>'
-                            
-                            def create_cdata_replacement(match):
-                                return f'<{element_tag}><![CDATA[{cdata_content}]]></{element_tag.split()[0]}>'
-                            
-                            # Replace only within this parent element
-                            modified_parent_content = re.sub(cdata_pattern, create_cdata_replacement, parent_content)
-                            
-                            # Replace the entire parent element in the output
-                            pretty_xml_output = pretty_xml_output.replace(
-                                f'<{parent_tag}>{parent_content}</{parent_tag}>', 
-                                f'<{parent_tag}>{modified_parent_content}</{parent_tag}>'
-                            )
-                else:
-                    # No identifiers, just use the tag
-                    pattern = f'<{element_tag}>([^<]*)</[^>]*>'
-                    
-                    def create_cdata_replacement(match):
-                        return f'<{element_tag}><![CDATA[{cdata_content}]]></{element_tag.split()[0]}>'
-                    
-                    pretty_xml_output = re.sub(pattern, create_cdata_replacement, pretty_xml_output)
-    
-    # Convert escaped XML content with XML declaration to CDATA sections
-    for element_tag, escaped_content in escaped_xml_elements.items():
-        # Skip if this element already has a CDATA section
-        if element_tag in cdata_by_tag:
-            continue
-            
-        # Create a pattern to find the element in the output
-        pattern = f'<{element_tag}>([^<]*)</[^>]*>'
-        
-        # Function to create replacement with CDATA
-        def create_cdata_replacement(match):
-            content = match.group(1)
-            # Unescape the content if it's escaped
-            content = content.replace('&lt;', '<').replace('&gt;', '>')
-            content = content.replace('&amp;lt;', '&lt;').replace('&amp;gt;', '&gt;')
-            content = content.replace('&quot;', '"').replace('&apos;', "'")
-            content = content.replace('&amp;quot;', '"')
-            content = content.replace('&amp;', '&')
-            # Return the CDATA section with the unescaped content
-            return '<' + element_tag + '><![CDATA[' + content + ']]></' + element_tag.split()[0] + '>'
-        
-        # Replace the content with CDATA section
-        pretty_xml_output = re.sub(pattern, create_cdata_replacement, pretty_xml_output)
-    
-    # Apply special handling for TransRouting and normalizationSettings elements
-    for context_key, (content_type, content) in xml_content_in_special_elements.items():
-        # Extract the element parts from the context key
-        parts = context_key.split(':')
-        parent_element = parts[0]  # TransRouting or normalizationSettings
-        xml_tag = parts[-1]  # The tag containing XML content (e.g., profileXml)
-        
-        # Build identifiers to find the specific element instance
-        identifiers = []
-        for part in parts[1:-1]:  # Skip the first (parent) and last (xml_tag) parts
-            if '=' in part:
-                identifiers.append(part)
-        
-        # Create a pattern to find the specific parent element with these identifiers
-        parent_pattern = f'<{parent_element}[^>]*>(.*?)</{parent_element}>'        
-        
-        # Find all instances of the parent element
-        for parent_match in re.finditer(parent_pattern, pretty_xml_output):
-            parent_content = parent_match.group(1)
-            
-            # Check if this is the right instance by matching all identifiers
-            is_matching_element = True
-            for identifier in identifiers:
-                id_parts = identifier.split('=')
-                if len(id_parts) == 2:
-                    id_type, id_value = id_parts
-                    # Check if this identifier exists in the parent content
-                    if not re.search(f'<{id_type}>{re.escape(id_value)}</{id_type}>', parent_content):
-                        is_matching_element = False
-                        break
-            
-            if is_matching_element:
-                # This is the matching element, replace its XML content with CDATA
-                xml_pattern = f'<{xml_tag}>([^<]*)</{xml_tag}>'                
-                
-                # Function to create CDATA replacement
-                def create_cdata_replacement(match):
-                    if content_type == "cdata":
-                        # Already CDATA, just use it directly
-																	
-                        return f'<{xml_tag}><![CDATA[{content}]]></{xml_tag}>'                        
-                    else:
-                        # Escaped content, unescape it first
-                        unescaped = content.replace('&lt;', '<').replace('&gt;', '>')
-                        unescaped = unescaped.replace('&amp;lt;', '&lt;').replace('&amp;gt;', '&gt;')
-                        unescaped = unescaped.replace('&quot;', '"').replace('&apos;', "'")
-                        unescaped = unescaped.replace('&amp;quot;', '"')
-                        unescaped = unescaped.replace('&amp;', '&')
-														
-																	  
-                        return f'<{xml_tag}><![CDATA[{unescaped}]]></{xml_tag}>'
-                
-                # Replace the XML content with CDATA in this parent element
-                modified_parent_content = re.sub(xml_pattern, create_cdata_replacement, parent_content)
-                
-                # Replace the entire parent element in the output
-                pretty_xml_output = pretty_xml_output.replace(
-                    f'<{parent_element}>{parent_content}</{parent_element}>', 
-                    f'<{parent_element}>{modified_parent_content}</{parent_element}>'
-                )
-    
-    # Find and convert any remaining escaped XML entities to CDATA format
-    # This handles cases where XML content is escaped but doesn't start with XML declaration
-    def convert_escaped_xml_to_cdata(match):
-        element_tag = match.group(1)
-        content = match.group(2)
-        
-        # Check if content contains escaped XML entities
-        if '&lt;' in content and '&gt;' in content:
-            # Unescape the content
-            unescaped = content.replace('&lt;', '<').replace('&gt;', '>')
-            unescaped = unescaped.replace('&amp;lt;', '&lt;').replace('&amp;gt;', '&gt;')
-            unescaped = unescaped.replace('&quot;', '"').replace('&apos;', "'")
-            unescaped = unescaped.replace('&amp;quot;', '"')
-            unescaped = unescaped.replace('&amp;', '&')
-            
-            # Only convert to CDATA if it looks like XML content
-            if '<' in unescaped and '>' in unescaped and ('</' in unescaped or '/>' in unescaped):
-										  
-															  
-                return f'<{element_tag}><![CDATA[{unescaped}]]></{element_tag.split()[0]}>'
-        
-        # Return original if no conversion needed
-        return match.group(0)
-    
-    # Apply conversion to all elements with potential escaped XML content
-    escaped_xml_pattern = re.compile(r'<([^>]+)>([^<>]*?&lt;[^<>]*?&gt;[^<]*?)</[^>]*>', re.DOTALL)
-    pretty_xml_output = re.sub(escaped_xml_pattern, convert_escaped_xml_to_cdata, pretty_xml_output)
-    
-    with open(output_file, 'w') as f:
-        f.write(pretty_xml_output)
+    # Convert back to XML with namespace preserved and write it straight to the output file,
+    # CDATA sections are written as they were read and escaped XML content as CDATA
+    f = open(output_file, 'w', encoding='utf-8', buffering=1 << 20)
+    try:
+        with f:
+            write_xml(f, root_tag, sorted_dict[root_tag], namespace, cdata_tags=xml_declaration_tags)
+    except BaseException:
+        # Do not leave a partly written output file behind
+        os.remove(output_file)
+        raise
 
 if __name__ == "__main__":
     # Set up command-line argument parsing